@@ -1,62 +1,135 @@
+import asyncio
+import json
+import os
+import select
+import shutil
+import socket
+import struct
 import sys
-from datetime import datetime
-from scapy.all import srp, Ether, ARP, conf
-
-# Last 3 bytes of the MAC address of each Tello.
-# Identified by the SSID printed on the
-# back of the head unit (RMTT-______)
-# Separate every 2 characters with a colon.
-macs = [
-    # "10:9b:b4",
-    # "f2:48:dc",
-    "d3:91:ca",
-    # "9a:ec:c6",
-    "33:14:9c",
-    "d2:71:04",
-    "9b:6f:6c",
-    # "9a:ec:dc",
-    # "10:b1:7c",
-    # "10:ac:0a",
-    "33:21:26",
-    # "33:14:9a",
-    # "f2:3b:1a",
-    # "33:09:aa",
-    # "10:a9:9c",
-]
-
-
-def ping_ips():
-    clients = arp_scan()
-    ips = []
-    num = 0
+import time
+
+from mission import load_mission
+
+# Results of the last scan, reused on restarts within `cache_ttl` seconds.
+cache_path = os.path.expanduser("~/.cache/tello-swarm/arp.json")
+cache_ttl = 60
+
+
+async def ping_ips(targets):
+    """
+    Returns the IP address of each MAC in `targets`, in order.
+
+    :param targets: Last 3 bytes of each Tello's MAC address, lowercase.
+    """
+    # scapy's sockets are blocking, so keep the scan off the event loop.
+    clients = await asyncio.get_running_loop().run_in_executor(
+        None, arp_scan_cached, targets)
     print(clients)
-    for mac in macs:
-        mac = mac.lower()
-        if clients.get(mac) is None:
-            num += 1
-            print("MAC address not found:", mac)
-            ips.append("192.168.51.1")
-        else:
-            ips.append(clients[mac])
-    print(f"{num} drones not found")
-    return ips
+    missing = [mac for mac in targets if mac not in clients]
+    if missing:
+        print(f"{len(missing)} drones not found")
+        raise RuntimeError(f"MAC addresses not found: {missing}")
+    return [clients[mac] for mac in targets]
 
 
-def arp_scan():
-    target_ip = "192.168.50.1/24"
-    arp = ARP(pdst=target_ip)
-    ether = Ether(dst="ff:ff:ff:ff:ff:ff")
-    packet = ether/arp
+# Subnet the Tellos are connected on, as the first three octets.
+subnet = (192, 168, 50)
+
+# How long to wait for replies after the request burst has gone out.
+reply_timeout = 0.5
+
+# Rate to send the request burst at when tcpreplay is available.
+tcpreplay_pps = 1000
+
+# Layer-2 socket and serialised ARP requests, shared across scans so each
+# request doesn't pay for scapy's packet construction and interface lookup.
+_l2socket = None
+_arp_requests = None
+
+# Last 3 bytes of the sender MAC, then the sender IP, from offset 25 of an ARP reply frame.
+_arp_sender = struct.Struct('!3s4s')
+_sendpfast = None
 
-    result = srp(packet, timeout=3)[0]
+
+def _get_l2socket():
+    global _l2socket, _arp_requests, _sendpfast
+    if _l2socket is None:
+        # scapy is slow to import, and isn't needed at all when the scan is cached.
+        from scapy.config import conf
+        from scapy.layers.l2 import ARP, Ether
+        conf.verb = 0
+        # Falls back to native sockets if libpcap isn't available.
+        conf.use_pcap = True
+
+        _l2socket = conf.L2socket(iface=conf.iface)
+        # Build once with a real address in the subnet so scapy resolves
+        # our own MAC and IP; only the target address is patched per request.
+        request = bytearray(bytes(
+            Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst="%d.%d.%d.1" % subnet)))
+        _arp_requests = []
+        for host in range(1, 255):
+            request[41] = host
+            _arp_requests.append(bytes(request))
+
+        # tcpreplay puts the whole burst on the wire from C.
+        if shutil.which(conf.prog.tcpreplay):
+            from scapy.sendrecv import sendpfast
+            _sendpfast = sendpfast
+    return _l2socket
+
+
+def arp_scan():
+    # Open the socket before sending so it is already listening for replies.
+    sock = _get_l2socket()
+    if _sendpfast is not None:
+        _sendpfast(_arp_requests, pps=tcpreplay_pps, iface=sock.iface)
+    else:
+        for request in _arp_requests:
+            sock.send(request)
 
     clients = {}
+    deadline = time.monotonic() + reply_timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not select.select([sock], [], [], remaining)[0]:
+            break
+        _, raw, _ = sock.recv_raw()
+        # Ethertype ARP, opcode is-at.
+        if raw is None or raw[12:14] != b'\x08\x06' or raw[20:22] != b'\x00\x02':
+            continue
+        # Only the last 3 bytes of the sender MAC identify a Tello.
+        mac, ip = _arp_sender.unpack_from(raw, 25)
+        clients[mac.hex(':')] = socket.inet_ntoa(ip)
+    return clients
+
 
-    for sent, received in result:
-        clients[received.hwsrc[-8:].lower()] = received.psrc
+def arp_scan_cached(targets, ttl=cache_ttl):
+    """
+    Returns the clients from the cache if it is younger than `ttl` seconds and has every
+    MAC in `targets`; otherwise does a live scan and caches the result.
+    """
+    try:
+        if time.time() - os.path.getmtime(cache_path) < ttl:
+            with open(cache_path) as f:
+                clients = json.load(f)
+            if all(mac in clients for mac in targets):
+                return clients
+    except (OSError, ValueError):
+        pass
+
+    clients = arp_scan()
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(clients, f)
+    os.replace(tmp_path, cache_path)
     return clients
 
 
 if __name__ == "__main__":
-    ips = ping_ips()
+    # The drones to look for come from the same mission file main.py flies.
+    mission = load_mission(sys.argv[1] if len(sys.argv) > 1 else None)
+    ips = asyncio.run(ping_ips(mission["macs"]))
     print(ips)
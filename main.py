@@ -1,28 +1,38 @@
 import asyncio
-from strategies import *
-from arp import arp_scan, ping_ips
+import logging
+import sys
+from strategies import follow_to_end
+from arp import ping_ips
+from mission import load_mission
 
 from swarm import SwarmManager
 
-path_pads = [1, 3]
-end_pads = [5, 6, 7, 8]
-distance = 200
-flight_1 = 50
-flight_2 = 50
-speed = 20
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
-
-async def main():
+async def main(mission):
     loop = asyncio.get_running_loop()
-    strategy = follow_to_end.FollowToEndPad(
-        path_pads, end_pads, distance, flight_1, flight_2, speed)
-    ips = ping_ips()
+    ips_task = asyncio.create_task(ping_ips(mission["macs"]))
+
+    strategy = follow_to_end.FollowToEndPad(**mission["strategy"])
+    manager = SwarmManager(loop, strategy)
 
-    manager = SwarmManager(loop, ips, strategy)
-    await manager.start_all_drones()
+    try:
+        # Bind the sockets and start the status thread while the scan runs.
+        await manager.open_endpoints()
+        manager.bind_drones(await ips_task)
+        await manager.start_all_drones()
 
-    await manager.on_con_lost
+        await manager.on_con_lost
+    finally:
+        manager.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    logging.basicConfig(level=logging.INFO)
+    if uvloop is not None:
+        # Applies to the status thread's loop too, as it's made with asyncio.new_event_loop().
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(main(load_mission(sys.argv[1] if len(sys.argv) > 1 else None)))
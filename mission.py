@@ -0,0 +1,18 @@
+import json
+import os
+
+# Mission flown when no mission file is given on the command line.
+default_mission = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "missions", "follow_to_end.json")
+
+
+def load_mission(path: str | None = None) -> dict:
+    """
+    Loads a mission file, with its MACs lowercased.
+
+    :param path: The mission file to load; `default_mission` if not given.
+    """
+    with open(path or default_mission) as f:
+        mission = json.load(f)
+    mission["macs"] = tuple(mac.lower() for mac in mission["macs"])
+    return mission
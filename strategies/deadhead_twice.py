@@ -1,27 +1,32 @@
+import logging
+
+from typing import List, Tuple
+
 from swarm import SwarmStrategy
-from tello import *
+from tello import TelloUnit
+
+log = logging.getLogger(__name__)
 
 
 class DeadheadNTimes(SwarmStrategy):
     def __init__(self, number_of_deadheads, distance, speed) -> None:
-        self.count_map: Dict[TelloUnit, int] = {}
         self.number_of_deadheads = number_of_deadheads
         self.distance = distance
         self.speed = speed
+        # The same leg is flown every time, so it's encoded once.
+        self._go_cmd = f'go {distance} 0 0 {speed}'.encode()
 
     def next_task(self,
                   tello: TelloUnit,
-                  last_task_result: str,
-                  tellos: List[TelloUnit]) -> Tuple[bool, str | None]:
-        if self.count_map.get(tello) is None:
-            self.count_map[tello] = 0
-        self.count_map[tello] += 1
-
-        if self.count_map[tello] < self.number_of_deadheads:
-            print(f'sending {tello.label} forward, this is the {self.count_map[tello]}th time.')
-            return True, f'go {self.distance} 0 0 {self.speed}'
+                  last_task_result: bytes,
+                  tellos: List[TelloUnit]) -> Tuple[bool, bytes | None]:
+        tello._deadhead_count += 1
+
+        if tello._deadhead_count < self.number_of_deadheads:
+            log.debug('sending %s forward, this is the %dth time.', tello.label, tello._deadhead_count)
+            return True, self._go_cmd
         else:
-            print(f'landing {tello.label}')
+            log.info('landing %s', tello.label)
             return False, None
 
     def on_tello_updated(self, tello: TelloUnit) -> bool:
@@ -1,5 +1,8 @@
+from typing import List, Tuple
+import weakref
+
 from swarm import SwarmStrategy
-from tello import *
+from tello import TelloUnit
 
 
 class FollowToBonusAndSearch(SwarmStrategy):
@@ -11,7 +14,8 @@ class FollowToBonusAndSearch(SwarmStrategy):
                  travel_speed: int,
                  window_speed: int
                  ) -> None:
-        self.count_map: Dict[TelloUnit, int] = {}
+        # Weakly keyed so a drone dropped from the swarm doesn't stay alive here.
+        self.count_map: "weakref.WeakKeyDictionary[TelloUnit, int]" = weakref.WeakKeyDictionary()
         self.num_of_search_tellos = num_of_search_tellos
         self.path_pad_nos = path_pad_nos
         self.window_pad_nos = window_pad_nos
@@ -21,8 +25,8 @@ class FollowToBonusAndSearch(SwarmStrategy):
 
     def next_task(self,
                   tello: TelloUnit,
-                  last_task_result: str,
-                  tellos: List[TelloUnit]) -> Tuple[bool, str | None]:
+                  last_task_result: bytes,
+                  tellos: List[TelloUnit]) -> Tuple[bool, bytes | None]:
         # Keeps track of queue
         if self.count_map.get(tello) is None:
             self.count_map[tello] = 0
@@ -1,7 +1,10 @@
-from typing import Dict, List, Tuple
+import logging
+from typing import List, Tuple
 from tello import TelloUnit
-from tasks import *
-from swarm import *
+from tasks import align_pad, find_pad
+from swarm import SwarmStrategy
+
+log = logging.getLogger(__name__)
 
 
 class FollowToEndPad(SwarmStrategy):
@@ -28,37 +31,50 @@ class FollowToEndPad(SwarmStrategy):
         self.flight_level_1 = flight_level_1
         self.flight_level_2 = flight_level_2
         self.speed = speed
+        # Flight level for even- and odd-indexed drones respectively.
+        self._altitudes = (flight_level_1, flight_level_2)
 
         self.pad_finder = find_pad.FindPadTask()
         self.pad_align = align_pad.AlignPadTask(
             speed, distance_between_pads, path_pad_nos, end_pad_nos)
 
+        self._end_pad_set = frozenset(end_pad_nos)
+        # Handlers indexed by the state computed in `next_task`; a missing marker
+        # can never be an end pad, so state 3 doesn't occur.
+        self._dispatch = (self._follow_path, self._search, self._align_end)
+
     def next_task(self,
                   tello: TelloUnit,
-                  last_task_result: str,
-                  tellos: List[TelloUnit]) -> Tuple[bool, str | None]:
-        index = tellos.index(tello)
-        altitude = self.flight_level_1 if index % 2 == 0 else self.flight_level_2
-        if tello.detected_marker is None:
-            print(
-                f"[FollowToEndPadStrategy] [{tello.ip}] Failed to find marker, attempting to recover")
-            # If we haven't seen a pad, try to go forward and see if we can detect one.
-            return self.pad_finder.execute(tello, altitude)
-        elif not (tello.detected_marker in self.end_pad_nos):
-            if tello.marker_yaw is None:
-                print(
-                    f"[FollowToEndPadStrategy] [{tello.ip}] help, drone detected marker but no yaw???")
-                return False, None
-            self.pad_finder.reset_tasks(tello)
-            # print(
-            #     f"[FollowToEndPadStrategy] [{tello.ip}] Current marker_yaw {tello.marker_yaw}")
-            return self.pad_align.align_pad(tello, altitude)
-        else:
-            if tello.marker_xy is None:
-                print(
-                    f"[FollowToEndPadStrategy] [{tello.ip}] help, drone detected marker but no coordinates???")
-                return False, None
-            return self.pad_align.align_end_pad(tello, altitude)
+                  last_task_result: bytes,
+                  tellos: List[TelloUnit]) -> Tuple[bool, bytes | None]:
+        altitude = self._altitudes[tello.idx & 1]
+        # Bit 0: no marker in sight. Bit 1: the marker ends the path.
+        marker = tello.detected_marker
+        state = (marker is None) | ((marker in self._end_pad_set) << 1)
+        return self._dispatch[state](tello, altitude)
+
+    def _follow_path(self, tello: TelloUnit, altitude: int) -> Tuple[bool, bytes | None]:
+        if tello.marker_yaw is None:
+            log.warning(
+                "[%s] help, drone detected marker but no yaw???", tello.ip)
+            return False, None
+        self.pad_finder.reset_tasks(tello)
+        # log.debug(
+        #     "[%s] Current marker_yaw %s", tello.ip, tello.marker_yaw)
+        return self.pad_align.align_pad(tello, altitude)
+
+    def _search(self, tello: TelloUnit, altitude: int) -> Tuple[bool, bytes | None]:
+        log.debug(
+            "[%s] Failed to find marker, attempting to recover", tello.ip)
+        # If we haven't seen a pad, try to go forward and see if we can detect one.
+        return self.pad_finder.execute(tello, altitude)
+
+    def _align_end(self, tello: TelloUnit, altitude: int) -> Tuple[bool, bytes | None]:
+        if tello.marker_xy is None:
+            log.warning(
+                "[%s] help, drone detected marker but no coordinates???", tello.ip)
+            return False, None
+        return self.pad_align.align_end_pad(tello, altitude)
 
     def on_tello_updated(self, tello: TelloUnit) -> bool:
         if tello.detected_marker in self.end_pad_nos and not tello.landing:
@@ -1,8 +1,15 @@
 import asyncio
-from asyncio import AbstractEventLoop, Future, transports
-from typing import Any, Dict, List, Tuple
+from asyncio import AbstractEventLoop
+import logging
+import socket
+import threading
+from typing import List, Tuple
 
-from tello import *
+from tello import (CMD_COMMAND, CMD_LAND, CMD_MON, CMD_STOP, CMD_TAKEOFF,
+                   TelloControlProtocol, TelloStatusProtocol, TelloUnit,
+                   create_draining_endpoint)
+
+log = logging.getLogger(__name__)
 
 
 class SwarmStrategy(object):
@@ -13,8 +20,8 @@ class SwarmStrategy(object):
 
     def next_task(self,
                   tello: TelloUnit,
-                  last_task_result: str,
-                  tellos: List[TelloUnit]) -> Tuple[bool, str | None]:
+                  last_task_result: bytes,
+                  tellos: List[TelloUnit]) -> Tuple[bool, str | bytes | None]:
         """
         Returns whether there is a next task to take, and if so,
         the next step taken by the drone. This method needs to be
@@ -23,6 +30,9 @@ class SwarmStrategy(object):
         If there is no next task to do, i.e. the bool returned is False,
         the drone will land in place.
 
+        The step may be returned already encoded as bytes, which is sent as-is; strategies
+        that repeat the same few commands should do so.
+
         Will be called after the drone sends an acknowledgement packet to us.
         """
         raise NotImplementedError
@@ -32,6 +42,7 @@ class SwarmStrategy(object):
         Called when a Tello unit is updated. Returns if the drone needs to be
         stopped, for `next_task` to be re-evaluated, e.g. if the drone sees a
         new mission pad.
+
         """
         raise NotImplementedError
 
@@ -39,151 +50,238 @@ class SwarmStrategy(object):
 class SwarmManager:
     def __init__(self,
                  loop: AbstractEventLoop,
-                 tello_ips: List[str],
                  strategy: SwarmStrategy) -> None:
         """
         Manages multiple TelloUnits. It keeps track of multiple tasking lists, and sends commands
         to each drone as the drone completes them.
 
+        Drones are added with `bind_drones` once their IP addresses are known, so the manager,
+        including its sockets (see `open_endpoints`), can be set up while the ARP scan is still
+        running.
+
         :param loop: The event loop to run under.
-        :param tasks: A dict mapping Tello IP addresses to the list of commands they are to complete.
+        :param strategy: The strategy providing each drone's next task.
         """
         self.loop = loop
 
-        self.tellos = [TelloUnit(ip) for ip in tello_ips]
+        self.tellos: List[TelloUnit] = []
 
         self.on_con_lost = loop.create_future()
+        self.control_transport = None
+        self.status_transport = None
 
         self.strategy = strategy
 
-        # Create each TelloUnit's `on_msg_received` future, and register a handler to it.
+        # Status packets are received and parsed on their own thread and event loop. Each
+        # batch drained from the socket reaches `loop` as one callback, applying the latest
+        # update for each drone, so `loop` wakes once per batch rather than once per packet;
+        # see TelloStatusProtocol. Both are made by `open_endpoints`.
+        self._status_loop: AbstractEventLoop | None = None
+        self._status_thread: threading.Thread | None = None
+
+    def bind_drones(self, tello_ips: List[str]) -> None:
+        """
+        Creates a TelloUnit for each IP address. Must be called before `start_all_drones`, but
+        may be called before or after `open_endpoints`.
+
+        :param tello_ips: The IP addresses of the Tellos to control.
+        """
+        self.tellos = [TelloUnit(ip, idx) for idx, ip in enumerate(tello_ips)]
         for tello in self.tellos:
-            tello.on_msg_received = self.loop.create_future()
-            # A bit annoying to do this, but we can't really await multiple async calls
-            # and respond to each call independently.
-            tello.on_msg_received.add_done_callback(
-                functools.partial(self.msg_received_callback, tello)
+            tello.label = chr(97 + tello.idx)
+            tello.label_cmd = f'EXT mled s r {tello.label}'.encode()
+
+        # If the endpoints are already open, route their packets to the new TelloUnits. The
+        # maps are replaced whole, as the status protocol reads its map on the status thread.
+        tello_by_ip = {tello.ip: tello for tello in self.tellos}
+        if self.control_transport is not None:
+            self.control_protocol.tello_by_ip = tello_by_ip
+        if self.status_transport is not None:
+            self.status_protocol.tello_by_ip = tello_by_ip
+
+    async def open_endpoints(self):
+        """
+        Binds the control and status sockets, and starts the status thread. Neither needs the
+        drones' IP addresses, so this can run while they're being found.
+        """
+        try:
+            self.control_transport, self.control_protocol = \
+                await self._open_control_endpoint()
+            self.status_transport, self.status_protocol = await self._open_status_endpoint()
+        except BaseException:
+            self.close()
+            raise
+
+    async def _open_control_endpoint(self):
+        # The control socket is made here so the protocol can send on it directly.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.bind(('0.0.0.0', 42345))
+            return await self.loop.create_datagram_endpoint(
+                lambda: TelloControlProtocol(self.tellos, self.on_con_lost, sock),
+                sock=sock
             )
+        except BaseException:
+            sock.close()
+            raise
 
     async def start_all_drones(self):
         """
-        Sends `command` to all drones, to put them in SDK mode.
+        Sends `command` to all drones, to put them in SDK mode, then flies every drone through
+        its tasking. Returns once every drone is done, with the sockets closed.
+
+        Opens the endpoints first if `open_endpoints` hasn't been called.
+        """
+        if self.control_transport is None:
+            await self.open_endpoints()
+
+        try:
+            # One task per drone, flying it from start to finish; see `_drive`.
+            async with asyncio.TaskGroup() as drones:
+                for tello in self.tellos:
+                    drones.create_task(self._drive(tello))
+                self.broadcast(CMD_COMMAND)
+        finally:
+            self.close()
+
+    async def _open_status_endpoint(self):
+        """
+        Starts the status thread, and opens the status endpoint on its event loop.
+        """
+        self._status_loop = asyncio.new_event_loop()
+        self._status_thread = threading.Thread(
+            target=self._status_loop.run_forever, name="tello-status", daemon=True)
+        self._status_thread.start()
+        # Status packets arrive from every drone at ~10 Hz, so drain them in batches.
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            create_draining_endpoint(
+                self._status_loop,
+                lambda: TelloStatusProtocol(
+                    self.tellos, self.tello_update_callback, self.loop),
+                local_addr=('0.0.0.0', TelloStatusProtocol.STATUS_PORT)
+            ),
+            self._status_loop
+        ))
+
+    def close(self):
+        """
+        Closes the sockets, fulfilling `self.on_con_lost`, and stops the status thread. Does
+        nothing if already closed.
+        """
+        if self.control_transport is not None and not self.control_transport.is_closing():
+            self.control_transport.close()
+        if self._status_loop is None:
+            return
+
+        if self.status_transport is not None:
+            self._status_loop.call_soon_threadsafe(self.status_transport.close)
+        self._status_loop.call_soon_threadsafe(self._status_loop.stop)
+        # Only a few callbacks can be left to run before the status loop stops.
+        self._status_thread.join()
+        self._status_loop.close()
+        self._status_loop = None
+        self._status_thread = None
+
+    def broadcast(self, command: str | bytes):
         """
-        self.control_transport, self.control_protocol = await self.loop.create_datagram_endpoint(
-            lambda: TelloControlProtocol(self.on_con_lost),
-            local_addr=('0.0.0.0', 42345)
-        )
+        Sends the same command to every drone at once.
+        """
+        self.control_protocol.broadcast(command, self.tellos)
 
-        self.status_transport, self.status_protocol = await self.loop.create_datagram_endpoint(
-            lambda: TelloStatusProtocol(
-                self.tellos, self.tello_update_callback),
-            local_addr=('0.0.0.0', TelloStatusProtocol.STATUS_PORT)
-        )
+    async def _drive(self, tello: TelloUnit):
+        """
+        Flies a single Tello from start to finish, landing it afterwards; see `_fly`.
 
-        for tello in self.tellos:
-            self.control_protocol.send_command("command", tello)
+        If flying the Tello fails, it is landed, and the other Tellos carry on.
+        """
+        try:
+            land = await self._fly(tello)
+        except Exception:
+            log.exception("Flying drone %s %s failed, landing", tello.label, tello.ip)
+            land = True
+        if land:
+            self.control_protocol.send_command(CMD_LAND, tello)
+        tello.finished = True
+
+    async def _fly(self, tello: TelloUnit) -> bool:
+        """
+        Waits for SDK mode, takes off, enables mission pad detection and labels the drone, then
+        flies the strategy's tasks until there are none left. `command` itself is broadcast by
+        `start_all_drones`.
+
+        Returns whether the Tello should be landed; it isn't if the drone reports an error.
+        """
+        data = await self._wait_for_ack(tello)
+        for command in (CMD_TAKEOFF, CMD_MON):
+            if data is None:
+                return False
+            data = await self._send_and_wait(command, tello)
+        if data is None:
+            return False
+
+        data = await self._send_and_wait(tello.label_cmd, tello)
+
+        while data is not None:
+            # Get the next task to perform from the strategy.
+            should_continue, next_task = self.strategy.next_task(
+                tello, data, self.tellos)
+
+            if not should_continue:
+                break
+            if next_task is None:
+                raise RuntimeError(
+                    "No action was provided despite continuing")
+            tello.stop_sent = False
+            data = await self._send_and_wait(next_task, tello)
+        else:
+            return False
+
+        # We're done for this drone.
+        log.info("Tasking complete for drone %s, landing", tello.ip)
+        return True
+
+    async def _send_and_wait(self, command: str | bytes, tello: TelloUnit) -> bytes | None:
+        """
+        Sends a command to a Tello, and waits for its acknowledgement.
+        """
+        self.control_protocol.send_command(command, tello)
+        return await self._wait_for_ack(tello)
+
+    async def _wait_for_ack(self, tello: TelloUnit) -> bytes | None:
+        """
+        Waits for the next `ok` from a Tello and returns it.
+
+        If the Tello sends an error instead, None is returned.
+        """
+        while True:
+            await tello.ack_event.wait()
+            tello.ack_event.clear()
+            data = tello.ack_data
+            log.debug("Received %r from %s", data, tello.ip)
+            if b'error' in data:
+                log.warning("Received error from drone %s %s", tello.label, tello.ip)
+                # just stop doing anything with this one
+                return None
+            if b'ok' in data:
+                return data
 
     def tello_update_callback(self, tello_updated: TelloUnit):
+        """
+        Called for every status packet, once the TelloUnit has been updated from it.
+        """
         need_to_stop = self.strategy.on_tello_updated(tello_updated)
         if need_to_stop and not tello_updated.stop_sent:
-            self.control_protocol.send_command('stop', tello_updated)
+            self.control_protocol.send_command(CMD_STOP, tello_updated)
             tello_updated.stop_sent = True
 
-    def msg_received_callback(self, tello: TelloUnit, received_future: Future):
-        """
-        Handler for when we receive an acknowledgement packet from the Tello unit.
-
-        Checks if the tasking for that particular unit is done; if not, it will send the next
-        command out. If all units managed by the `SwarmHandler` have completed their tasking, the
-        transport will be closed, fulfilling `self.on_con_lost`.
-
-        To be used as a partial function call when registering callbacks:
-
-        ```
-        future.add_done_callback(functools.partial(self.handle_ack, tello))
-        ```
-
-        :param tello: The TelloUnit this handler was registered to.
-        :param received_future: To be filled in by `add_done_callback`.
-        """
-        data = received_future.result()
-        # print(f"[SwarmManager] Received {data} from {tello.ip}")
-        if b'error' in data:
-            print(
-                f"[SwarmManager] Received error from drone {tello.label} {tello.ip}")
-            should_continue, next_task = False, None
-            # just stop doing anything with this one
-            tello.finished = True
-        elif b'ok' in data:
-            # print(f"[SwarmManager] Received ok from drone {tello.ip}")
-
-            # print(
-            #     f"[SwarmManager] Drone {tello.ip} detects mission pad {tello.detected_marker}")
-
-            if not tello.started:
-                tello.started = True
-                tello.on_msg_received = self.loop.create_future()
-                tello.on_msg_received.add_done_callback(
-                    functools.partial(self.msg_received_callback, tello)
-                )
-                self.control_protocol.send_command('takeoff', tello)
-
-            elif not tello.camera_activated:
-                tello.camera_activated = True
-                tello.on_msg_received = self.loop.create_future()
-                tello.on_msg_received.add_done_callback(
-                    functools.partial(self.msg_received_callback, tello)
-                )
-                self.control_protocol.send_command('mon', tello)
-
-            elif tello.label == '':
-                tello.on_msg_received = self.loop.create_future()
-                tello.on_msg_received.add_done_callback(
-                    functools.partial(self.msg_received_callback, tello)
-                )
-                label = chr(97 + self.tellos.index(tello))
-                tello.label = label
-                self.control_protocol.send_command(
-                    f'EXT mled s r {label}', tello)
-            else:
-                # Get the next task to perform from the strategy.
-                should_continue, next_task = self.strategy.next_task(
-                    tello, data, self.tellos)
-
-                if should_continue and not tello.finished:
-                    if next_task is None:
-                        raise RuntimeError(
-                            "No action was provided despite continuing")
-                    # print(
-                    #     f"[SwarmManager] Sending command '{next_task}' to drone {tello.ip}")
-                    tello.stop_sent = False
-                    tello.on_msg_received = self.loop.create_future()
-                    tello.on_msg_received.add_done_callback(
-                        functools.partial(self.msg_received_callback, tello)
-                    )
-                    self.control_protocol.send_command(next_task, tello)
-                else:
-                    # We're done for this drone.
-                    print(
-                        f"[SwarmManager] Tasking complete for drone {tello.ip}, landing")
-                    tello.on_msg_received = self.loop.create_future()
-                    tello.on_msg_received.add_done_callback(
-                        functools.partial(self.msg_received_callback, tello)
-                    )
-                    self.control_protocol.send_command('land', tello)
-                    tello.finished = True
-
-                    # If we're done for all drones, close the socket.
-                    if (all(tello.finished for tello in self.tellos)):
-                        self.control_transport.close()
-
 
 class SwarmTask(object):
     """
     Generic tasks for all strategies
     """
 
-    def execute(self, tello: TelloUnit) -> Tuple[bool, str]:
+    def execute(self, tello: TelloUnit) -> Tuple[bool, str | bytes]:
         """Abstract execution function
 
         :param tello: The TelloUnit to execute the task on.
@@ -1,4 +1,10 @@
-from swarm import *
+import logging
+from typing import List, Tuple
+
+from swarm import SwarmTask
+from tello import TelloUnit, encode_int
+
+log = logging.getLogger(__name__)
 
 
 class AlignPadTask(SwarmTask):
@@ -13,38 +19,52 @@ class AlignPadTask(SwarmTask):
         self.end_pad_nos = end_pad_nos
         super().__init__()
 
-    def align_yaw(self, tello: TelloUnit) -> Tuple[bool, str]:
-        yaw_command = "cw" if tello.marker_yaw > 0 else "ccw"
+        # Only the altitude, yaw and pad number change between commands; everything around
+        # them is encoded once here.
+        self._go_path_prefix = f'go {distance_between_pads} 0 '.encode()
+        self._go_end_prefix = b'go 0 0 '
+        self._speed_infix = f' {speed} m'.encode()
+        # How far off the end pad's centre, on each axis, still counts as aligned.
+        self._align_tol = 10
+        # Indexed by whether the yaw is positive.
+        self._yaw_prefix = (b'ccw ', b'cw ')
+
+    def align_yaw(self, tello: TelloUnit) -> Tuple[bool, bytes]:
+        yaw = tello.marker_yaw
         return (
             True,
-            f'{yaw_command} {abs(tello.marker_yaw)}'
+            self._yaw_prefix[yaw > 0] + encode_int(-yaw if yaw < 0 else yaw)
         )
 
-    def align_pad(self, tello: TelloUnit, altitude: int) -> Tuple[bool, str]:
-        if abs(tello.marker_yaw) >= 10:
-            # print(
-            #     f"[AlignPadTask] [{tello.ip}] Aligning yaw to path pad; current yaw {tello.marker_yaw}")
+    def align_pad(self, tello: TelloUnit, altitude: int) -> Tuple[bool, bytes]:
+        yaw = tello.marker_yaw
+        if yaw >= 10 or yaw <= -10:
+            # log.debug(
+            #     "[%s] Aligning yaw to path pad; current yaw %s", tello.ip, tello.marker_yaw)
             return self.align_yaw(tello)
         else:
             if not (tello.detected_marker in self.path_pad_nos):
-                print(
-                    f"[AlignPadTask] Fatal error: Aligning to pad {tello.detected_marker} not within path numbers")
+                log.error(
+                    "Fatal error: Aligning to pad %s not within path numbers", tello.detected_marker)
             return (
                 True,
-                f'go {self.distance_between_pads} 0 {altitude} {self.speed} m{tello.detected_marker}'
+                self._go_path_prefix + encode_int(altitude) + self._speed_infix
+                + encode_int(tello.detected_marker)
             )
 
-    def align_end_pad(self, tello: TelloUnit, altitude: int) -> Tuple[bool, str | None]:
+    def align_end_pad(self, tello: TelloUnit, altitude: int) -> Tuple[bool, bytes | None]:
         marker_x, marker_y = tello.marker_xy
-        if abs(marker_x) <= 10 and abs(marker_y) <= 10:
+        tol = self._align_tol
+        if -tol <= marker_x <= tol and -tol <= marker_y <= tol:
             tello.landing = True
-            print(
-                f"[AlignPadTask] [{tello.ip}] Successfully aligned to landing pad; current rel coordinates {tello.marker_xy}")
+            log.info(
+                "[%s] Successfully aligned to landing pad; current rel coordinates %s", tello.ip, tello.marker_xy)
             return False, None
         else:
-            print(
-                f"[AlignPadTask] [{tello.ip}] Aligning to landing pad; current rel coordinates {tello.marker_xy}")
+            log.debug(
+                "[%s] Aligning to landing pad; current rel coordinates %s", tello.ip, tello.marker_xy)
             return (
                 True,
-                f'go 0 0 {altitude} {self.speed} m{tello.detected_marker}'
+                self._go_end_prefix + encode_int(altitude) + self._speed_infix
+                + encode_int(tello.detected_marker)
             )
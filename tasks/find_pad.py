@@ -1,12 +1,23 @@
-from swarm import *
+from typing import Tuple
+
+from swarm import SwarmTask
+from tello import TelloUnit, encode_int
 
 
 class FindPadTask(SwarmTask):
+    # Grid search pattern flown around the last known position to find a pad, pre-encoded.
+    SEARCH_CMDS = (
+        b"left 50",
+        b"forward 20",
+        b"right 50",
+        b"right 50",
+        b"forward 20",
+        b"left 50",
+    )
+
     def __init__(self) -> None:
-        super().__init__()
-        self.tellos_last_search_tasks = {}
         """
-        The last search task that each TelloUnit seen has performed.
+        The last search task each TelloUnit has performed is kept in its `_search_task_idx`.
         The overall grid search pattern is:
         0: Go left
         1: Go forward
@@ -15,28 +26,18 @@ class FindPadTask(SwarmTask):
         4: Go forward
         5: Go left
         """
+        super().__init__()
 
     def reset_tasks(self, tello) -> None:
-        self.tellos_last_search_tasks[tello] = None
+        tello._search_task_idx = -1
 
-    def execute(self, tello: TelloUnit, search_altitude: int) -> Tuple[bool, str]:
+    def execute(self, tello: TelloUnit, search_altitude: int) -> Tuple[bool, bytes]:
         """
         Get the TelloUnit to do a rough grid search around the perimeter to find the pad.
         """
 
-        movement_commands = [
-            f"left 50",
-            f"forward 20",
-            f"right 50",
-            f"right 50",
-            f"forward 20",
-            f"left 50",
-        ]
-
-        if self.tellos_last_search_tasks.get(tello) is None:
-            self.tellos_last_search_tasks[tello] = -1
         if abs(search_altitude - tello.height) >= 20:
-            return (True, f"go 0 0 {search_altitude - tello.height} 10")
+            return (True, b"go 0 0 " + encode_int(search_altitude - tello.height) + b" 10")
         else:
-            self.tellos_last_search_tasks[tello] += 1
-            return (True, movement_commands[self.tellos_last_search_tasks[tello] % 6])
+            tello._search_task_idx += 1
+            return (True, self.SEARCH_CMDS[tello._search_task_idx % 6])
@@ -1,17 +1,156 @@
 import asyncio
 from asyncio import AbstractEventLoop, Future, transports
-from collections import deque
-import functools
+import ctypes
+import ctypes.util
+import logging
+import re
+import socket
+import sys
 from typing import Any, Callable, Dict, List, Tuple
 
+log = logging.getLogger(__name__)
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _sockaddr_in(ctypes.Structure):
+    # Port and address are kept in network byte order.
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_ubyte * 2),
+                ('sin_addr', ctypes.c_ubyte * 4),
+                ('sin_zero', ctypes.c_ubyte * 8)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+
+_libc_sendmmsg = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc_sendmmsg = ctypes.CDLL(
+            ctypes.util.find_library('c'), use_errno=True).sendmmsg
+        _libc_sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                                   ctypes.c_uint, ctypes.c_int]
+        _libc_sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        _libc_sendmmsg = None
+
+
+# Fixed commands sent by SwarmManager, already encoded.
+CMD_COMMAND = b'command'
+CMD_TAKEOFF = b'takeoff'
+CMD_MON = b'mon'
+CMD_STOP = b'stop'
+CMD_LAND = b'land'
+
+# Encoded form of each command string sent so far. Missions repeat a small vocabulary of
+# commands, so this stays small; it stops growing at `_CMD_CACHE_MAX` just in case.
+_CMD_CACHE: Dict[str, bytes] = {}
+_CMD_CACHE_MAX = 1024
+
+
+def _encode_command(command: str | bytes) -> bytes:
+    if isinstance(command, bytes):
+        return command
+    payload = _CMD_CACHE.get(command)
+    if payload is None:
+        payload = command.encode('utf-8')
+        if len(_CMD_CACHE) < _CMD_CACHE_MAX:
+            _CMD_CACHE[command] = payload
+    return payload
+
+
+# Encoded decimal form of every integer the SDK accepts for distances, altitudes and
+# angles, so commands can be assembled from bytes without formatting.
+_INT_LIMIT = 500
+_INT_BYTES = tuple(str(i).encode() for i in range(-_INT_LIMIT, _INT_LIMIT + 1))
+
+
+def encode_int(n: int) -> bytes:
+    """
+    Returns the decimal form of `n`, encoded for use in a command.
+    """
+    if -_INT_LIMIT <= n <= _INT_LIMIT:
+        return _INT_BYTES[n + _INT_LIMIT]
+    return str(n).encode()
+
+
+def _sendmmsg(fd: int, packets: List[Tuple[bytes, Tuple[str, int]]]) -> int:
+    """
+    Sends IPv4 UDP datagrams on the socket `fd` with a single `sendmmsg(2)` call.
+
+    :param packets: `(payload, (ip, port))` for each datagram.
+    :return: The number of datagrams sent, which may be fewer than given; -1 on error.
+    """
+    n = len(packets)
+    msgs = (_mmsghdr * n)()
+    iovs = (_iovec * n)()
+    addrs = (_sockaddr_in * n)()
+    bufs = []
+    for i, (payload, (ip, port)) in enumerate(packets):
+        buf = ctypes.create_string_buffer(payload, len(payload))
+        bufs.append(buf)
+        iovs[i].iov_base = ctypes.addressof(buf)
+        iovs[i].iov_len = len(payload)
+        addrs[i].sin_family = socket.AF_INET
+        addrs[i].sin_port[:] = port.to_bytes(2, 'big')
+        addrs[i].sin_addr[:] = socket.inet_aton(ip)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(addrs[i])
+        hdr.msg_namelen = ctypes.sizeof(_sockaddr_in)
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+    return _libc_sendmmsg(fd, msgs, n, 0)
+
 
 class TelloUnit:
-    def __init__(self, ip: str) -> None:
+    __slots__ = (
+        'ip',
+        '_addr',
+        'idx',
+        'ack_event',
+        'ack_data',
+        'label',
+        'label_cmd',
+        'finished',
+        'detected_marker',
+        'marker_xy',
+        'marker_yaw',
+        'height',
+        'stop_sent',
+        'landing',
+        '_search_task_idx',
+        '_deadhead_count',
+        '__weakref__',
+    )
+
+    def __init__(self, ip: str, idx: int = 0) -> None:
         self.ip = ip
-        self.on_msg_received: Future | None = None
-        self.started = False
-        self.camera_activated = False
+        # Control address, built once so sends don't allocate a new tuple each time.
+        self._addr = (ip, TelloControlProtocol.CONTROL_PORT)
+        # Position of this unit in its swarm.
+        self.idx = idx
+        # Set when an ack from the drone is waiting in `ack_data`, and cleared by SwarmManager's
+        # coroutine for this drone once it takes it. Further acks arriving while one is waiting
+        # are dropped.
+        self.ack_event = asyncio.Event()
+        self.ack_data: bytes = b''
         self.label = ''
+        # Encoded command showing `label` on the LED matrix.
+        self.label_cmd = b''
         self.finished = False
         self.detected_marker: int | None = None
         self.marker_xy: Tuple[int, int] | None = None
@@ -19,42 +158,101 @@ class TelloUnit:
         self.height: int = 0
         self.stop_sent: bool = False
         self.landing: bool = False
+        # Step of FindPadTask's search pattern last flown; -1 before the first step.
+        self._search_task_idx: int = -1
+        # Number of legs flown under DeadheadNTimes.
+        self._deadhead_count: int = 0
 
 
 class TelloControlProtocol(asyncio.DatagramProtocol):
     CONTROL_PORT = 8889
 
-    def __init__(self, on_conn_lost: Future):
+    def __init__(self,
+                 tellos: List[TelloUnit],
+                 on_conn_lost: Future,
+                 sock: socket.socket | None = None):
         """
         Control protocol for multiple Tellos. It asynchronously sends UDP packets to each
         unit, waiting for each unit to reply with a `b"ok"`.
 
+        :param tellos: The Tellos to be controlled.
         :param on_conn_lost: A `Future` that gets fulfilled if the connection is closed.
-        :param tello_update_callback: A method that gets called when a Tello is updated.
+        :param sock: The non-blocking socket the transport is created with, if any. Commands
+            are then sent on it directly, skipping the transport, whenever the transport has
+            nothing queued.
         """
         self.transport = None
         self.on_conn_lost = on_conn_lost
+        self._sock = sock
 
-        # An internal dictionary mapping IP addresses to the `on_msg_received` callbacks for each
-        # TelloUnit sent here.
-        self.on_message_received_for = {}
+        # An internal dictionary mapping IP addresses to each TelloUnit, for routing acks.
+        self.tello_by_ip: Dict[str, TelloUnit] = {tello.ip: tello for tello in tellos}
 
-    def send_command(self, command: str, tello: TelloUnit):
+    def send_command(self, command: str | bytes, tello: TelloUnit):
         """
-        Send a command to a TelloUnit.
+        Send a command to a TelloUnit. The command may be given already encoded.
 
-        The TelloUnit's `current_future` will be fulfilled when acknowledgement has been
-        received from the Tello.
+        The acknowledgement from the Tello will be put in the TelloUnit's `ack_data`, and
+        its `ack_event` set.
         """
 
         if self.transport is not None:
-            self.on_message_received_for[tello.ip] = tello.on_msg_received
-            print(f"[TelloControlProtocol] Sending {command} to {tello.ip}")
-            self.transport.sendto(command.encode(
-                'utf-8'), (tello.ip, self.CONTROL_PORT))
+            # Dropped quietly once closing, as transport.sendto would; the raw socket wouldn't.
+            if self.transport.is_closing():
+                return
+            payload = _encode_command(command)
+            log.debug("Sending %r to %s", payload, tello.ip)
+            # Only bypass the transport when it has nothing queued, to keep datagrams in order.
+            if self._sock is not None and self.transport.get_write_buffer_size() == 0:
+                try:
+                    self._sock.sendto(payload, tello._addr)
+                    return
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError as exc:
+                    # As the transport would do.
+                    self.error_received(exc)
+                    return
+            self.transport.sendto(payload, tello._addr)
         else:
             raise RuntimeError("UDP transport hasn't been initialized yet")
 
+    def broadcast(self, command: str | bytes, tellos: List[TelloUnit]):
+        """
+        Send the same command to several TelloUnits.
+        """
+        payload = _encode_command(command)
+        # Every packet shares the one encoded payload; only the address differs.
+        self.send_command_many([(tello, payload) for tello in tellos])
+
+    def send_command_many(self, commands: List[Tuple[TelloUnit, str | bytes]]):
+        """
+        Send a command to each of several TelloUnits, e.g. when several drones are given their
+        next task at once.
+
+        On Linux the datagrams go out in one `sendmmsg` call; anything it doesn't send, or
+        everything on other platforms, is sent one at a time through the transport.
+        """
+        if self.transport is None:
+            raise RuntimeError("UDP transport hasn't been initialized yet")
+        if self.transport.is_closing():
+            return
+
+        packets = []
+        for tello, command in commands:
+            payload = _encode_command(command)
+            log.debug("Sending %r to %s", payload, tello.ip)
+            packets.append((payload, tello._addr))
+
+        sent = 0
+        # Only bypass the transport when it has nothing queued, to keep datagrams in order.
+        if _libc_sendmmsg is not None and len(packets) > 1 \
+                and self.transport.get_write_buffer_size() == 0:
+            sock = self.transport.get_extra_info('socket')
+            sent = max(_sendmmsg(sock.fileno(), packets), 0)
+        for packet in packets[sent:]:
+            self.transport.sendto(*packet)
+
     def connection_made(self, transport: transports.DatagramTransport) -> None:
         super().connection_made(transport)
         self.transport = transport
@@ -66,28 +264,50 @@ class TelloControlProtocol(asyncio.DatagramProtocol):
         if b'keepalive' in data or b'forced stop' in data:
             return
 
-        # Lookup the future for the tello that sent this packet,
-        # then fulfil the future.
-        if not self.on_message_received_for[addr[0]].done():
-            self.on_message_received_for[addr[0]].set_result(data)
+        # Hand the packet to the tello that sent it, unless it already has an ack waiting.
+        tello = self.tello_by_ip.get(addr[0])
+        if tello is not None and not tello.ack_event.is_set():
+            tello.ack_data = data
+            tello.ack_event.set()
 
     def error_received(self, exc: Exception) -> None:
         super().error_received(exc)
-        print(f"[TelloClientProtocol] Error: {exc}")
+        log.error("Control socket error: %s", exc)
 
     def connection_lost(self, exc: Exception | None) -> None:
         super().connection_lost(exc)
-        print("[TelloClientProtocol] Connection closed")
+        log.info("Control connection closed")
         self.on_conn_lost.set_result(True)
 
 
+# The fields of a status packet used: mission pad id, x, y, the marker's yaw (the second of
+# mpry's three values) and height, which comes nine fields after mpry.
+_STATUS_RE = re.compile(
+    rb'mid:(-?\d+);x:(-?\d+);y:(-?\d+);z:-?\d+;mpry:-?\d+,(-?\d+),-?\d+;(?:[^;]*;){9}h:(-?\d+);')
+
+
 class TelloStatusProtocol(asyncio.DatagramProtocol):
     STATUS_PORT = 8890
 
-    def __init__(self, tellos: List[TelloUnit], tello_update_callback: Callable[[TelloUnit], Any]) -> None:
+    def __init__(self,
+                 tellos: List[TelloUnit],
+                 tello_update_callback: Callable[[TelloUnit], Any],
+                 tello_loop: AbstractEventLoop | None = None) -> None:
+        """
+        Status protocol for multiple Tellos, updating each TelloUnit from its status packets.
+
+        :param tellos: The Tellos to be updated.
+        :param tello_update_callback: A method that gets called when a Tello is updated.
+        :param tello_loop: The event loop the TelloUnits are used on, if packets are received on
+            another thread. Packets are still parsed where they're received, but updates are
+            applied, and the callback called, on `tello_loop`, so the TelloUnits are only ever
+            changed on the loop reading them. Each batch of packets is handed over at once,
+            keeping only the latest update for each Tello.
+        """
         super().__init__()
         self.tello_by_ip = {tello.ip: tello for tello in tellos}
         self.tello_update_callback = tello_update_callback
+        self.tello_loop = tello_loop
 
     def connection_made(self, transport: transports.DatagramTransport) -> None:
         super().connection_made(transport)
@@ -95,31 +315,141 @@ class TelloStatusProtocol(asyncio.DatagramProtocol):
 
     def datagram_received(self, data: bytes, addr: tuple[str | Any, int]) -> None:
         super().datagram_received(data, addr)
-        data_array = data.decode('utf-8').split(';')
-        _, mid = data_array[0].split(':')
-        _, x = data_array[1].split(':')
-        _, y = data_array[2].split(':')
-        _, z = data_array[3].split(':')
-        _, mpry = data_array[4].split(':')
-        _, height = data_array[14].split(':')
+        self.datagrams_received([(data, addr)])
 
-        x = int(x)
-        y = int(y)
-        z = int(z)
+    def datagrams_received(self, datagrams: List[Tuple[bytes, Tuple[str | Any, int]]]) -> None:
+        """
+        Parses a batch of status packets, and applies the latest update for each Tello in it.
+        """
+        tello_by_ip = self.tello_by_ip
+        updates: Dict[TelloUnit, tuple] = {}
+        for data, addr in datagrams:
+            # Ignore anything that isn't from one of our drones, before doing any parsing.
+            tello_to_update = tello_by_ip.get(addr[0])
+            if tello_to_update is None:
+                continue
 
-        _, marker_yaw, _ = (int(x) for x in mpry.split(','))
+            # int() parses ASCII digits straight from bytes, so there's no need to decode.
+            match = _STATUS_RE.match(data)
+            if match is None:
+                continue
+            mid, x, y, marker_yaw, height = match.groups()
+            mid = int(mid)
+            if mid > 0:
+                updates[tello_to_update] = (int(height), mid, (int(x), int(y)), int(marker_yaw))
+            else:
+                updates[tello_to_update] = (int(height), None, None, None)
 
-        tello_to_update = self.tello_by_ip[addr[0]]
-        tello_to_update.detected_marker = int(mid) if int(mid) > 0 else None
-        tello_to_update.marker_xy = (x, y) if int(mid) > 0 else None
-        tello_to_update.marker_yaw = marker_yaw if int(mid) > 0 else None
-        tello_to_update.height = int(height)
+        if not updates:
+            return
+        if self.tello_loop is None:
+            self._apply_updates(updates)
+        else:
+            self.tello_loop.call_soon_threadsafe(self._apply_updates, updates)
 
-        self.tello_update_callback(tello_to_update)
+    def _apply_updates(self, updates: Dict[TelloUnit, tuple]) -> None:
+        for tello, (height, detected_marker, marker_xy, marker_yaw) in updates.items():
+            tello.height = height
+            tello.detected_marker = detected_marker
+            tello.marker_xy = marker_xy
+            tello.marker_yaw = marker_yaw
+            self.tello_update_callback(tello)
 
     def error_received(self, exc: Exception) -> None:
-        print(exc)
+        log.error("Status socket error: %s", exc)
         return super().error_received(exc)
 
     def connection_lost(self, exc: Exception | None) -> None:
         super().connection_lost(exc)
+
+
+class DrainingDatagramTransport:
+    """
+    A minimal datagram transport that, each time its socket becomes readable, reads every
+    datagram queued on it (up to `max_batch`) before returning to the event loop. asyncio's
+    own datagram transport reads one datagram per wakeup, so a burst of status packets from
+    the whole swarm costs one loop iteration per packet.
+
+    If the protocol has a `datagrams_received(datagrams)` method, each drained batch is passed
+    to it as one list of `(data, addr)` pairs, so the protocol can handle the batch as a whole;
+    otherwise `datagram_received` is called for each datagram.
+
+    Only receiving is supported; create it with `create_draining_endpoint`.
+    """
+
+    def __init__(self,
+                 loop: AbstractEventLoop,
+                 sock: socket.socket,
+                 protocol: asyncio.DatagramProtocol,
+                 max_batch: int = 64) -> None:
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self.max_batch = max_batch
+        self._closing = False
+
+        sock.setblocking(False)
+        protocol.connection_made(self)
+        loop.add_reader(sock.fileno(), self._read_ready)
+
+    def _read_ready(self) -> None:
+        recvfrom = self._sock.recvfrom
+        datagrams = []
+        for _ in range(self.max_batch):
+            try:
+                datagrams.append(recvfrom(2048))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self._protocol.error_received(exc)
+                break
+        if not datagrams:
+            return
+
+        datagrams_received = getattr(self._protocol, 'datagrams_received', None)
+        if datagrams_received is not None:
+            datagrams_received(datagrams)
+        else:
+            for data, addr in datagrams:
+                self._protocol.datagram_received(data, addr)
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        if name == 'socket':
+            return self._sock
+        if name == 'sockname':
+            return self._sock.getsockname()
+        return default
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._protocol.connection_lost(None)
+
+
+async def create_draining_endpoint(loop: AbstractEventLoop,
+                                   protocol_factory: Callable[[], asyncio.DatagramProtocol],
+                                   local_addr: Tuple[str, int] | None = None,
+                                   sock: socket.socket | None = None
+                                   ) -> Tuple[DrainingDatagramTransport, asyncio.DatagramProtocol]:
+    """
+    Like `loop.create_datagram_endpoint`, but receives through a `DrainingDatagramTransport`.
+
+    :param local_addr: The address to bind a new UDP socket to, if `sock` isn't given.
+    :param sock: An already bound UDP socket to use instead.
+    """
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(local_addr)
+        except OSError:
+            sock.close()
+            raise
+    protocol = protocol_factory()
+    transport = DrainingDatagramTransport(loop, sock, protocol)
+    return transport, protocol